@@ -9,18 +9,43 @@ Start:
 
 import streamlit as st
 import pandas as pd
-import xml.etree.ElementTree as ET
+import numpy as np
 import json
 import hashlib
+import html
 import os
 import re
 import base64
+import io
 import zlib
+from collections import Counter
 from datetime import datetime
+from types import MappingProxyType
+from xml.sax.saxutils import escape
+
+# lxml (libxml2) parst deutlich schneller und sparsamer; stdlib als Fallback
+try:
+    import lxml.etree as ET
+    HAVE_LXML = True
+except ImportError:
+    import xml.etree.ElementTree as ET
+    HAVE_LXML = False
+
+# orjson (C) für die Kommentar-Serialisierung; stdlib json als Fallback
+try:
+    import orjson
+    HAVE_ORJSON = True
+except ImportError:
+    HAVE_ORJSON = False
 
 APP_TITLE = "Draw.io → Normalisierte XML → FMEDA → Feedback (JSON)"
 DATA_DIR = "data"
-COMMENTS_FILE = os.path.join(DATA_DIR, "comments.json")
+COMMENTS_FILE = os.path.join(DATA_DIR, "comments.json")  # Altformat, nur noch gelesen
+COMMENTS_LOG = os.path.join(DATA_DIR, "comments.jsonl")
+PREVIEW_ROWS = 200  # Tabellen zeigen standardmäßig nur einen Auszug
+GRAPH_AUTO_MAX_NODES = 150  # größere Graphen nur auf Wunsch layouten
+
+HTML_TAG_RE = re.compile(r"<[^>]+>")
 
 # ---------------------------
 # Utility
@@ -32,31 +57,68 @@ def ensure_dirs():
 def now_iso():
     return datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
 
+def json_dumps_bytes(obj, pretty: bool = False) -> bytes:
+    """
+    JSON als UTF-8-Bytes – kompakt (eine Zeile) oder mit 2er-Einrückung.
+    """
+    if HAVE_ORJSON:
+        option = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS if pretty else 0
+        return orjson.dumps(obj, option=option)
+    if pretty:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def json_loads(data):
+    return orjson.loads(data) if HAVE_ORJSON else json.loads(data)
+
+def xml_fromstring(data):
+    """
+    XML parsen – mit lxml (huge_tree, ohne Entity-Auflösung), sonst stdlib.
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    if HAVE_LXML:
+        parser = ET.XMLParser(huge_tree=True, remove_blank_text=True, resolve_entities=False)
+        return ET.fromstring(data, parser=parser)
+    return ET.fromstring(data)
+
 def file_sha256(b: bytes) -> str:
     return hashlib.sha256(b).hexdigest()
 
 def safe_text(v: str) -> str:
-    if v is None:
+    if not v:
         return ""
+    # Schneller Pfad: reine Text-Labels brauchen weder Regex noch Unescape
+    if "<" not in v and "&" not in v:
+        return v.strip()
     # Remove basic HTML tags Draw.io sometimes embeds in 'value' but keep text
-    return re.sub(r"<[^>]+>", "", v).strip()
+    return html.unescape(HTML_TAG_RE.sub("", v)).strip()
+
+DECODE_CHUNK = 64 * 1024  # Vielfaches von 4 (base64-Blockgröße)
 
 def decode_drawio_diagram_text(diagram_text: str) -> str:
     """
     Draw.io (<diagram>...</diagram>) kann komprimiert (base64+deflate) sein.
     Dies dekodiert nach XML (<mxGraphModel>...</mxGraphModel>).
     - Wenn es bereits XML enthält, gib es direkt zurück.
-    - Sonst: base64-decode + zlib.decompress(wbits=-15).
+    - Sonst: base64-decode + zlib-inflate (wbits=-15), blockweise, damit
+      nie der komplette dekodierte Zwischenpuffer im Speicher liegt.
     """
     if not diagram_text:
         return ""
     if "<mxGraphModel" in diagram_text or "<mxfile" in diagram_text or "<root>" in diagram_text:
         return diagram_text
     try:
-        raw = base64.b64decode(diagram_text)
+        b64 = "".join(diagram_text.split())
         # Draw.io verwendet "raw deflate" (ohne zlib header), daher wbits=-15
-        xml_bytes = zlib.decompress(raw, -15)
-        return xml_bytes.decode("utf-8", errors="replace")
+        decomp = zlib.decompressobj(-15)
+        out = bytearray()
+        for i in range(0, len(b64), DECODE_CHUNK):
+            out += decomp.decompress(base64.b64decode(b64[i:i + DECODE_CHUNK]))
+        out += decomp.flush()
+        if not decomp.eof:
+            raise zlib.error("incomplete or truncated stream")
+        return out.decode("utf-8", errors="replace")
     except Exception:
         return diagram_text
 
@@ -64,53 +126,56 @@ def decode_drawio_diagram_text(diagram_text: str) -> str:
 # Draw.io Parsing
 # ---------------------------
 
-def parse_drawio_xml(xml_bytes: bytes):
+@st.cache_data(show_spinner=False, max_entries=32)
+def parse_drawio_xml(_xml_bytes: bytes, diagram_hash: str):
     """
-    Gibt (nodes, edges, dot, normalized_xml_str, meta) zurück.
+    Gibt (nodes, edges, meta) zurück.
+    diagram_hash: beim Upload einmalig berechnet und zugleich Cache-Schlüssel;
+    _xml_bytes wird von Streamlit nicht noch einmal gehasht (führender Unterstrich).
     nodes: dict id -> {id, label, style, type_guess}
     edges: list of {id, source, target, label}
-    dot: Graphviz DOT string (digraph)
-    normalized_xml_str: unsere eigene, schlanke XML-Repräsentation
     meta: {diagram_hash, node_count, edge_count}
+    DOT und normalisierte XML entstehen erst bei Bedarf (dot_source,
+    normalized_xml_bytes).
     """
-    root = ET.fromstring(xml_bytes)
+    root = xml_fromstring(_xml_bytes)
 
     # Fall A: <mxfile><diagram>...</diagram></mxfile>
     diagrams = root.findall(".//diagram")
-    mx_root = None
     if diagrams:
-        d = diagrams[0]
-        mx_text = decode_drawio_diagram_text((d.text or "").strip())
-        if mx_text:
-            mx_root = ET.fromstring(mx_text)
+        mx_text = decode_drawio_diagram_text((diagrams[0].text or "").strip())
+        if not mx_text:
+            raise ValueError("Konnte kein <mxGraphModel> in der .drawio-Datei finden.")
+        # Die äußere Hülle wird nicht mehr gebraucht; nur die Nutzlast streamen
+        del root, diagrams
+        cells = iter_mx_cells(mx_text.encode("utf-8"))
+        del mx_text
     else:
-        # Fall B: Datei ist bereits ein <mxGraphModel> oder enthält es irgendwo
+        # Fall B: Datei ist bereits ein <mxGraphModel> oder enthält es irgendwo.
+        # Der Baum liegt schon vor – direkt durchlaufen statt erneut zu parsen.
         if root.tag == "mxGraphModel":
             mx_root = root
         else:
-            found = root.findall(".//mxGraphModel")
-            if found:
-                mx_root = found[0]
-
-    if mx_root is None:
-        raise ValueError("Konnte kein <mxGraphModel> in der .drawio-Datei finden.")
-
-    cell_root = mx_root.find(".//root")
-    if cell_root is None:
-        raise ValueError("Unerwartete Draw.io-Struktur: <root> unter <mxGraphModel> fehlt.")
+            mx_root = root.find(".//mxGraphModel")
+        if mx_root is None:
+            raise ValueError("Konnte kein <mxGraphModel> in der .drawio-Datei finden.")
+        cell_root = mx_root.find(".//root")
+        if cell_root is None:
+            raise ValueError("Unerwartete Draw.io-Struktur: <root> unter <mxGraphModel> fehlt.")
+        cells = (cell.attrib for cell in cell_root.findall("mxCell"))
 
     nodes = {}
     edges = []
 
     # Zellen einlesen
-    for cell in cell_root.findall("mxCell"):
-        cid = cell.get("id", "")
-        value = cell.get("value", "")
-        style = cell.get("style", "")
-        is_vertex = cell.get("vertex") == "1"
-        is_edge = cell.get("edge") == "1"
-        source = cell.get("source")
-        target = cell.get("target")
+    for attrs in cells:
+        cid = attrs.get("id", "")
+        value = attrs.get("value", "")
+        style = attrs.get("style", "")
+        is_vertex = attrs.get("vertex") == "1"
+        is_edge = attrs.get("edge") == "1"
+        source = attrs.get("source")
+        target = attrs.get("target")
 
         if is_vertex:
             label = safe_text(value)
@@ -133,82 +198,118 @@ def parse_drawio_xml(xml_bytes: bytes):
     for n in nodes.values():
         n["type_guess"] = guess_component_type(n["label"], n["style"])
 
-    # DOT bauen
-    dot = build_dot(nodes, edges)
-
-    # Normalisierte XML erzeugen
-    normalized_xml_str = build_normalized_xml(nodes, edges)
-
     meta = {
-        "diagram_hash": file_sha256(xml_bytes),
+        "diagram_hash": diagram_hash,
         "node_count": len(nodes),
         "edge_count": len(edges),
     }
-    return nodes, edges, dot, normalized_xml_str, meta
+    return nodes, edges, meta
+
+def iter_mx_cells(mx_bytes: bytes):
+    """
+    Streamt die Attribute der <mxCell>-Elemente unter <root> des dekodierten
+    Diagramms (iterparse). Gelesene Zellen werden sofort verworfen, es entsteht
+    kein vollständiger Baum des Modells.
+    """
+    opts = {"huge_tree": True, "resolve_entities": False} if HAVE_LXML else {}
+    stack = []
+    model = None
+    cell_root = None
+    for event, elem in ET.iterparse(io.BytesIO(mx_bytes), events=("start", "end"), **opts):
+        if event == "start":
+            if model is None:
+                model = elem
+            elif cell_root is None and elem.tag == "root":
+                cell_root = elem
+            stack.append(elem)
+            continue
+
+        stack.pop()
+        if cell_root is not None and elem.tag == "mxCell" and stack and stack[-1] is cell_root:
+            yield dict(elem.attrib)
+            # Zelle und bereits verarbeitete Geschwister freigeben
+            elem.clear()
+            del cell_root[:-1]
+
+    if cell_root is None:
+        raise ValueError("Unerwartete Draw.io-Struktur: <root> unter <mxGraphModel> fehlt.")
+
+# Gatter: "and"/"or" nur als ganze Wörter (sonst wäre "Sensor" ein OR-Gatter)
+AND_WORD_RE = re.compile(r"\band\b")
+OR_WORD_RE = re.compile(r"\bor\b")
+
+# Übrige Typen: Teilstrings im Label, in Prioritätsreihenfolge
+TYPE_KEYWORDS = (
+    ("Watchdog", ("watchdog", "wdt")),
+    ("Sensor", ("sensor",)),
+    ("MCU", ("mcu", "microcontroller", "cpu", "uc")),
+    ("ADC", ("adc",)),
+    ("LDO/Regulator", ("ldo", "regulator")),
+    ("Comparator", ("comparator", "cmp")),
+    ("OpAmp", ("opamp", "op-amp", "op amp", "amp")),
+    ("MOSFET", ("mosfet", "fet")),
+    ("Connector", ("connector", "conn", "stecker", "pin")),
+    ("Interface", ("can", "lin", "uart", "spi", "i2c", "ethernet")),
+    ("Power", ("battery", "charger", "buck", "boost", "power", "psu")),
+)
 
 def guess_component_type(label: str, style: str) -> str:
     L = (label or "").lower()
     S = (style or "").lower()
 
-    def contains_any(s, arr): return any(x in s for x in arr)
-
-    if contains_any(L, ["and", "∧"]) or "shape=and" in S:
+    # Teilstring-Vortest, die Regex läuft nur bei möglichem Treffer
+    if "∧" in L or ("and" in L and AND_WORD_RE.search(L)) or "shape=and" in S:
         return "AND Gate"
-    if contains_any(L, ["or", "∨"]) or "shape=or" in S:
+    if "∨" in L or ("or" in L and OR_WORD_RE.search(L)) or "shape=or" in S:
         return "OR Gate"
-    if contains_any(L, ["watchdog", "wdt"]):
-        return "Watchdog"
-    if contains_any(L, ["sensor"]):
-        return "Sensor"
-    if contains_any(L, ["mcu", "microcontroller", "cpu", "uc"]):
-        return "MCU"
-    if contains_any(L, ["adc"]):
-        return "ADC"
-    if contains_any(L, ["ldo", "regulator"]):
-        return "LDO/Regulator"
-    if contains_any(L, ["comparator", "cmp"]):
-        return "Comparator"
-    if contains_any(L, ["opamp", "op-amp", "op amp", "amp"]):
-        return "OpAmp"
-    if contains_any(L, ["mosfet", "fet"]):
-        return "MOSFET"
-    if contains_any(L, ["connector", "conn", "stecker", "pin"]):
-        return "Connector"
-    if contains_any(L, ["can", "lin", "uart", "spi", "i2c", "ethernet"]):
-        return "Interface"
-    if contains_any(L, ["battery", "charger", "buck", "boost", "power", "psu"]):
-        return "Power"
+    for ctype, keywords in TYPE_KEYWORDS:
+        if any(k in L for k in keywords):
+            return ctype
     return "Function"
 
 def build_dot(nodes, edges):
-    # Einfache gerichtete Darstellung
-    lines = ["digraph G {", "rankdir=LR;", "node [shape=box, fontsize=10];"]
-    for n in nodes.values():
-        label = f"{n['label']}\\n({n['type_guess']})" if n.get("type_guess") else n["label"]
-        lines.append(f"\"{n['id']}\" [label=\"{label}\"];")
-    for e in edges:
-        lab = f" [label=\"{e['label']}\"]" if e.get("label") else ""
-        lines.append(f"\"{e.get('source','')}\" -> \"{e.get('target','')}\"{lab};")
-    lines.append("}")
-    return "\n".join(lines)
+    # Einfache gerichtete Darstellung; Zeilen per Comprehension, ein einziges join
+    node_lines = [
+        f"\"{n['id']}\" [label=\"{n['label']}\\n({n['type_guess']})\"];" if n.get("type_guess")
+        else f"\"{n['id']}\" [label=\"{n['label']}\"];"
+        for n in nodes.values()
+    ]
+    edge_lines = [
+        f"\"{e.get('source','')}\" -> \"{e.get('target','')}\" [label=\"{e['label']}\"];" if e.get("label")
+        else f"\"{e.get('source','')}\" -> \"{e.get('target','')}\";"
+        for e in edges
+    ]
+    return "\n".join(["digraph G {", "rankdir=LR;", "node [shape=box, fontsize=10];", *node_lines, *edge_lines, "}"])
+
+# Escaping wie libxml2 bei Attributen (immer doppelte Anführungszeichen)
+XML_ATTR_ENTITIES = {'"': "&quot;", "\n": "&#10;", "\r": "&#13;", "\t": "&#9;"}
+
+def xml_attr(v: str) -> str:
+    return '"' + escape(v, XML_ATTR_ENTITIES) + '"'
+
+def xml_container(tag: str, children) -> str:
+    # Leere Container als <tag/>, wie es libxml2 serialisiert
+    if not children:
+        return f"<{tag}/>"
+    return f"<{tag}>" + "".join(children) + f"</{tag}>"
 
 def build_normalized_xml(nodes, edges) -> str:
-    root = ET.Element("normalizedDiagram")
-    nlist = ET.SubElement(root, "nodes")
-    for n in nodes.values():
-        el = ET.SubElement(nlist, "node")
-        el.set("id", n["id"])
-        el.set("label", n["label"])
-        el.set("type", n.get("type_guess", ""))
-    elist = ET.SubElement(root, "edges")
-    for e in edges:
-        el = ET.SubElement(elist, "edge")
-        el.set("id", e["id"])
-        el.set("source", e.get("source") or "")
-        el.set("target", e.get("target") or "")
-        if e.get("label"):
-            el.set("label", e["label"])
-    return ET.tostring(root, encoding="utf-8").decode("utf-8")
+    # Direkt als Text: kein Zwischenbaum, Ausgabe wie zuvor ET.tostring (lxml)
+    node_parts = [
+        f"<node id={xml_attr(n['id'])} label={xml_attr(n['label'])} type={xml_attr(n.get('type_guess', ''))}/>"
+        for n in nodes.values()
+    ]
+    edge_parts = [
+        f"<edge id={xml_attr(e['id'])} source={xml_attr(e.get('source') or '')} target={xml_attr(e.get('target') or '')}"
+        + (f" label={xml_attr(e['label'])}/>" if e.get("label") else "/>")
+        for e in edges
+    ]
+    return "".join([
+        "<normalizedDiagram>",
+        xml_container("nodes", node_parts),
+        xml_container("edges", edge_parts),
+        "</normalizedDiagram>",
+    ])
 
 # ---------------------------
 # FMEDA Heuristik
@@ -228,30 +329,28 @@ FMEDA_COLUMNS = [
     "notes",
 ]
 
-FMEDA_TEMPLATES = {
-    "Sensor": ["Open circuit", "Short circuit", "Drift/Offset"],
-    "Comparator": ["Stuck high", "Stuck low", "Offset drift"],
-    "OpAmp": ["Output saturates high", "Output saturates low", "Gain drift"],
-    "MCU": ["CPU hang", "I/O stuck", "Clock fail"],
-    "ADC": ["Conversion freeze", "Code stuck", "Reference drift"],
-    "MOSFET": ["Drain-source short", "Open circuit", "Gate oxide short"],
-    "LDO/Regulator": ["Output overvoltage", "Output undervoltage", "Shutdown stuck"],
-    "Connector": ["Pin open", "Short between pins"],
-    "Interface": ["Bus stuck dominant", "Bus stuck recessive", "Frame loss"],
-    "Power": ["No output", "Overvoltage", "Undervoltage"],
-    "AND Gate": ["Logical fault"],
-    "OR Gate":  ["Logical fault"],
-    "Function": ["Failure to perform function"],
-}
+FMEDA_TEMPLATES = MappingProxyType({
+    "Sensor": ("Open circuit", "Short circuit", "Drift/Offset"),
+    "Comparator": ("Stuck high", "Stuck low", "Offset drift"),
+    "OpAmp": ("Output saturates high", "Output saturates low", "Gain drift"),
+    "MCU": ("CPU hang", "I/O stuck", "Clock fail"),
+    "ADC": ("Conversion freeze", "Code stuck", "Reference drift"),
+    "MOSFET": ("Drain-source short", "Open circuit", "Gate oxide short"),
+    "LDO/Regulator": ("Output overvoltage", "Output undervoltage", "Shutdown stuck"),
+    "Connector": ("Pin open", "Short between pins"),
+    "Interface": ("Bus stuck dominant", "Bus stuck recessive", "Frame loss"),
+    "Power": ("No output", "Overvoltage", "Undervoltage"),
+    "AND Gate": ("Logical fault",),
+    "OR Gate":  ("Logical fault",),
+    "Function": ("Failure to perform function",),
+})
+
+# Typ -> Fehlermodi als Series für den spaltenweisen Lookup in build_fmeda
+FMEDA_MODES = pd.Series(dict(FMEDA_TEMPLATES))
 
 def has_watchdog(nodes):
     return any(n.get("type_guess") == "Watchdog" for n in nodes.values())
 
-def infer_effect(component_label, outgoing_count):
-    if outgoing_count > 0:
-        return f"Propagates to {outgoing_count} downstream node(s)"
-    return "Local effect only"
-
 def infer_detection(n, global_watchdog):
     t = n.get("type_guess")
     if t == "MCU" and global_watchdog:
@@ -263,58 +362,150 @@ def infer_detection(n, global_watchdog):
     return "TBD"
 
 def build_fmeda(nodes, edges):
-    out_deg = {n: 0 for n in nodes}
-    for e in edges:
-        if e.get("source") in out_deg:
-            out_deg[e["source"]] += 1
+    if not nodes:
+        return pd.DataFrame(columns=FMEDA_COLUMNS)
 
-    rows = []
     global_wd = has_watchdog(nodes)
+    values = list(nodes.values())
+    nd = pd.DataFrame({
+        "component_id": list(nodes),
+        "component_label": [n["label"] for n in values],
+        "component_type": [n.get("type_guess", "Function") for n in values],
+        "detection": [infer_detection(n, global_wd) for n in values],
+    })
+
+    out_deg = Counter(e["source"] for e in edges if e.get("source") in nodes)
+    # Counter liefert über __missing__ 0 für Knoten ohne ausgehende Kanten
+    nd["out_deg"] = nd["component_id"].map(out_deg).astype(int)
+
+    known = nd["component_type"].where(nd["component_type"].isin(FMEDA_MODES.index), "Function")
+    nd["failure_mode"] = FMEDA_MODES.reindex(known).to_numpy()
+
+    # Eine Zeile je (Komponente, Fehlermodus)
+    df = nd.explode("failure_mode", ignore_index=True)
+    deg = df["out_deg"]
+    df["effect"] = np.where(
+        deg > 0,
+        "Propagates to " + deg.astype(str) + " downstream node(s)",
+        "Local effect only",
+    )
+    df["row_id"] = "R" + (df.index + 1).astype(str).str.zfill(4)
+    df["diagnostic_coverage"] = ""
+    df["failure_rate_FIT"] = ""
+    df["safety_relevance"] = "TBD"
+    df["notes"] = ""
+    return df[FMEDA_COLUMNS]
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def build_fmeda_cached(diagram_hash: str, _nodes, _edges):
+    """
+    FMEDA je Diagramm cachen. Schlüssel ist allein diagram_hash –
+    _nodes/_edges werden von Streamlit nicht gehasht (führender Unterstrich).
+    """
+    return build_fmeda(_nodes, _edges)
 
-    rid = 1
-    for nid, n in nodes.items():
-        ctype = n.get("type_guess", "Function")
-        modes = FMEDA_TEMPLATES.get(ctype, FMEDA_TEMPLATES["Function"])
-        for fm in modes:
-            rows.append({
-                "row_id": f"R{rid:04d}",
-                "component_id": nid,
-                "component_label": n["label"],
-                "component_type": ctype,
-                "failure_mode": fm,
-                "effect": infer_effect(n["label"], out_deg.get(nid, 0)),
-                "detection": infer_detection(n, global_wd),
-                "diagnostic_coverage": "",
-                "failure_rate_FIT": "",
-                "safety_relevance": "TBD",
-                "notes": "",
-            })
-            rid += 1
-    df = pd.DataFrame(rows, columns=FMEDA_COLUMNS)
-    return df
+# ---------------------------
+# DOT & Exporte (je Diagramm gecacht)
+# ---------------------------
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def dot_source(diagram_hash: str, _nodes, _edges) -> str:
+    return build_dot(_nodes, _edges)
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def normalized_xml_bytes(diagram_hash: str, _nodes, _edges) -> bytes:
+    return build_normalized_xml(_nodes, _edges).encode("utf-8")
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def fmeda_csv_bytes(diagram_hash: str, _df) -> bytes:
+    return _df.to_csv(index=False).encode("utf-8")
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def fmeda_json_bytes(diagram_hash: str, _df) -> bytes:
+    return _df.to_json(orient="records", force_ascii=False, indent=2).encode("utf-8")
 
 # ---------------------------
 # Kommentare (JSON) speichern/lesen
 # ---------------------------
 
 def load_comments():
+    """
+    Gibt (comments, skipped) zurück. Nicht lesbare Zeilen – etwa eine beim
+    Schreiben abgebrochene letzte Zeile – werden übersprungen und gezählt,
+    statt das ganze Log zu verwerfen.
+    """
     ensure_dirs()
+    if not os.path.exists(COMMENTS_LOG):
+        return migrate_legacy_comments(), 0
+    comments = []
+    skipped = 0
+    try:
+        with open(COMMENTS_LOG, "rb") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    comments.append(json_loads(line))
+                except ValueError:
+                    skipped += 1
+    except OSError:
+        return [], 0
+    return comments, skipped
+
+def migrate_legacy_comments():
+    """
+    Übernimmt eine vorhandene data/comments.json einmalig ins JSONL-Log.
+    Geschrieben wird in eine temporäre Datei, die erst vollständig per
+    os.replace zum Log wird – ein Abbruch hinterlässt kein halbes Log.
+    """
     if not os.path.exists(COMMENTS_FILE):
         return []
     try:
-        with open(COMMENTS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+        with open(COMMENTS_FILE, "rb") as f:
+            comments = json_loads(f.read())
     except Exception:
         return []
-
-def save_comments(comments_list):
-    ensure_dirs()
-    with open(COMMENTS_FILE, "w", encoding="utf-8") as f:
-        json.dump(comments_list, f, ensure_ascii=False, indent=2)
+    tmp_path = COMMENTS_LOG + ".tmp"
+    with open(tmp_path, "wb") as f:
+        for entry in comments:
+            f.write(dump_comment_line(entry))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, COMMENTS_LOG)
+    return comments
+
+def dump_comment_line(entry) -> bytes:
+    return json_dumps_bytes(entry) + b"\n"
 
 def add_comment_entry(existing, entry):
+    # Append-only: pro Kommentar genau eine Zeile, alte Einträge bleiben unberührt
+    ensure_dirs()
+    with open(COMMENTS_LOG, "ab+") as f:
+        # Endet das Log nach einem abgebrochenen Schreibvorgang ohne Zeilenumbruch,
+        # zuerst abschließen – sonst würde der neue Eintrag an die kaputte Zeile gehängt
+        if f.seek(0, os.SEEK_END) > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+        f.write(dump_comment_line(entry))
     existing.append(entry)
-    save_comments(existing)
+
+# ---------------------------
+# UI-Helfer
+# ---------------------------
+
+def show_table(df, key: str):
+    """
+    Tabelle in einem Expander, der nur bei kleinen Tabellen offen startet.
+    Gerendert werden die ersten PREVIEW_ROWS Zeilen, die komplette Tabelle
+    nur auf Wunsch, da jede Zeile bei jedem Rerun nach Arrow serialisiert wird.
+    """
+    large = len(df) > PREVIEW_ROWS
+    with st.expander(f"Tabelle ({len(df)} Zeilen)", expanded=not large):
+        if large and not st.checkbox(f"Alle {len(df)} Zeilen anzeigen", key=f"show_all_{key}"):
+            st.caption(f"Auszug: {PREVIEW_ROWS} von {len(df)} Zeilen")
+            df = df.head(PREVIEW_ROWS)
+        st.dataframe(df, width="stretch", hide_index=True)
 
 # ---------------------------
 # Streamlit UI
@@ -322,7 +513,7 @@ def add_comment_entry(existing, entry):
 
 st.set_page_config(page_title=APP_TITLE, layout="wide")
 st.title(APP_TITLE)
-st.caption("V1 – Heuristische FMEDA-Erzeugung. Kommentare werden in data/comments.json persistiert.")
+st.caption("V1 – Heuristische FMEDA-Erzeugung. Kommentare werden in data/comments.jsonl persistiert.")
 
 with st.sidebar:
     st.markdown("### Schritte")
@@ -339,25 +530,36 @@ if uploaded is None:
     st.info("Bitte eine `.drawio`/`.xml`-Datei hochladen. Die App unterstützt auch komprimierte Draw.io-Diagramme.")
     st.stop()
 
-raw = uploaded.read()
-diagram_hash = file_sha256(raw)
+# Upload je Datei nur einmal lesen, hashen und parsen; Reruns durch andere
+# Widgets (z. B. das Kommentarformular) greifen nur auf die Session zu
+upload = st.session_state.setdefault("upload", {})
+if upload.get("file_id") != uploaded.file_id:
+    upload.clear()
+    raw = uploaded.getvalue()
+    diagram_hash = file_sha256(raw)
+    try:
+        parsed = parse_drawio_xml(raw, diagram_hash)
+    except Exception as e:
+        st.error(f"Fehler beim Parsen: {e}")
+        st.stop()
+    upload.update(file_id=uploaded.file_id, diagram_hash=diagram_hash, parsed=parsed)
 
-try:
-    nodes, edges, dot, normalized_xml_str, meta = parse_drawio_xml(raw)
-except Exception as e:
-    st.error(f"Fehler beim Parsen: {e}")
-    st.stop()
+diagram_hash = upload["diagram_hash"]
+nodes, edges, meta = upload["parsed"]
 
 col_a, col_b, col_c = st.columns([2,2,1])
 
 with col_a:
     st.subheader("Graph (DOT-Vorschau)")
-    # Ohne deprecated use_container_width
-    st.graphviz_chart(dot)
+    dot = dot_source(diagram_hash, nodes, edges)
+    # Das Layout ist bei großen Diagrammen der teuerste Schritt – nur auf Wunsch
+    if st.checkbox("Graph anzeigen", value=meta["node_count"] <= GRAPH_AUTO_MAX_NODES):
+        # Ohne deprecated use_container_width
+        st.graphviz_chart(dot)
 
     st.download_button(
         "Normalisierte XML herunterladen",
-        data=normalized_xml_str.encode("utf-8"),
+        data=normalized_xml_bytes(diagram_hash, nodes, edges),
         file_name="normalized_diagram.xml",
         mime="application/xml"
     )
@@ -370,21 +572,28 @@ with col_b:
         {"id": n["id"], "label": n["label"], "type": n.get("type_guess",""), "style": n.get("style","")}
         for n in nodes.values()
     ])
-    st.dataframe(nd, width="stretch", hide_index=True)
+    show_table(nd, "nodes")
 
 with col_c:
     st.subheader("Kanten")
     ed = pd.DataFrame(edges)
-    st.dataframe(ed, width="stretch", hide_index=True)
+    show_table(ed, "edges")
 
 st.divider()
 
 st.subheader("FMEDA (Skelett)")
-fmeda_df = build_fmeda(nodes, edges)
-st.dataframe(fmeda_df, width="stretch", hide_index=True)
-
-fm_csv = fmeda_df.to_csv(index=False).encode("utf-8")
-fm_json = fmeda_df.to_json(orient="records", force_ascii=False, indent=2).encode("utf-8")
+# In der Session halten, damit Formular-Reruns nicht einmal den Cache bemühen
+fmeda_state = st.session_state.get("fmeda")
+if fmeda_state is None or fmeda_state[0] != diagram_hash:
+    df = build_fmeda_cached(diagram_hash, nodes, edges)
+    # Zusätzlich nach row_id indiziert für den Zeilen-Lookup beim Kommentieren
+    fmeda_state = (diagram_hash, df, df.set_index("row_id", drop=False))
+    st.session_state["fmeda"] = fmeda_state
+_, fmeda_df, fmeda_indexed = fmeda_state
+show_table(fmeda_df, "fmeda")
+
+fm_csv = fmeda_csv_bytes(diagram_hash, fmeda_df)
+fm_json = fmeda_json_bytes(diagram_hash, fmeda_df)
 
 d1, d2 = st.columns(2)
 with d1:
@@ -394,16 +603,25 @@ with d2:
 
 st.divider()
 
-existing_comments = load_comments()
+# Kommentare nur einmal je Session von der Platte lesen, danach in-place pflegen
+if "comments" not in st.session_state:
+    st.session_state["comments"], st.session_state["comments_skipped"] = load_comments()
+existing_comments = st.session_state["comments"]
+if st.session_state["comments_skipped"]:
+    st.warning(f"{st.session_state['comments_skipped']} unlesbare Zeile(n) in `{COMMENTS_LOG}` übersprungen.")
 
 st.subheader("Feedback / Kommentare zur FMEDA")
-st.caption("Kommentare werden in `data/comments.json` gespeichert und bei jedem neuen Eintrag aktualisiert.")
-
-row_ids = fmeda_df["row_id"].tolist()
-row_labels = fmeda_df[["row_id","component_label","failure_mode"]].apply(
-    lambda r: f"{r.row_id} | {r.component_label} | {r.failure_mode}", axis=1
-).tolist()
-row_map = dict(zip(row_labels, row_ids))
+st.caption("Kommentare werden in `data/comments.jsonl` gespeichert (eine Zeile je Eintrag); der Download liefert sie als JSON.")
+
+# Auswahl-Labels je Diagramm nur einmal bilden (spaltenweise String-Verkettung)
+labels_state = st.session_state.get("row_labels")
+if labels_state is None or labels_state[0] != diagram_hash:
+    labels = (
+        fmeda_df["row_id"] + " | " + fmeda_df["component_label"] + " | " + fmeda_df["failure_mode"]
+    ).tolist()
+    labels_state = (diagram_hash, labels, dict(zip(labels, fmeda_df["row_id"])))
+    st.session_state["row_labels"] = labels_state
+_, row_labels, row_map = labels_state
 
 with st.form("comment_form", border=True):
     sel_row = st.selectbox("FMEDA-Zeile", options=row_labels)
@@ -417,7 +635,7 @@ if submitted:
         st.warning("Bitte einen Kommentartext eingeben.")
     else:
         rid = row_map[sel_row]
-        row = fmeda_df.loc[fmeda_df["row_id"] == rid].iloc[0].to_dict()
+        row = fmeda_indexed.loc[rid].to_dict()
         entry = {
             "timestamp": now_iso(),
             "diagram_hash": diagram_hash,
@@ -440,13 +658,12 @@ if submitted:
         add_comment_entry(existing_comments, entry)
         st.success("Kommentar gespeichert.")
 
-existing_comments = load_comments()
 st.subheader("Vorliegende Kommentare")
 if existing_comments:
-    st.dataframe(pd.DataFrame(existing_comments), width="stretch", hide_index=True)
+    show_table(pd.DataFrame(existing_comments), "comments")
     st.download_button(
         "Kommentare (JSON) herunterladen",
-        data=json.dumps(existing_comments, ensure_ascii=False, indent=2).encode("utf-8"),
+        data=json_dumps_bytes(existing_comments, pretty=True),
         file_name="comments.json",
         mime="application/json"
     )